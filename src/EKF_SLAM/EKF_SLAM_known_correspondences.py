@@ -7,6 +7,7 @@ See Probabilistic Robotics:
 
 '''
 
+import math
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -16,17 +17,27 @@ class ExtendedKalmanFilterSLAM():
     def __init__(self, dataset, robot, start_frame, end_frame, R, Q, plot, plot_inter):
         self.load_data(dataset, robot, start_frame, end_frame)
         self.initialization(R, Q)
-        for data in self.data:
-            if (data[1] == -1):
-                self.motion_update(data)
+        for k in range(len(self._ts)):
+            if (self._subj[k] == -1):
+                self.motion_update(self._ts[k], self._v[k], self._w[k])
             else:
-                self.measurement_update(data)
+                self.measurement_update(self._ts[k], self._subj[k], self._v[k], self._w[k])
             # Plot every n frames
             if plot and plot_inter:
                 if (len(self.states) > (800 - start_frame) and len(self.states) % 30 == 0):
                     self.plot_data()
         if plot: self.plot_data()
 
+    @property
+    def states(self):
+        # Filled part of the state history buffer
+        return self._states_buf[:self._n]
+
+    @property
+    def stamps(self):
+        # Filled part of the timestamp history buffer
+        return self._stamps_buf[:self._n]
+
     def load_data(self, dataset, robot, start_frame, end_frame):
         # Loading dataset
         # Barcodes: [Subject#, Barcode#]
@@ -53,17 +64,20 @@ class ExtendedKalmanFilterSLAM():
             start_frame += 1
         # Remove all data before start_frame and after the end_timestamp
         self.data = self.data[start_frame:end_frame]
+        # Column views of the input data, the main loop reads them by index
+        # [Time[s], Subject#, forward_V[m/s] or range[m], angular _v[rad/s] or bearing[rad]]
+        self._ts = self.data[:, 0]
+        self._subj = self.data[:, 1].astype(np.int32)
+        self._v = self.data[:, 2]
+        self._w = self.data[:, 3]
         start_timestamp = self.data[0][0]
         end_timestamp = self.data[-1][0]
         # Remove all groundtruth outside the range
-        for i in range(len(self.groundtruth_data)):
-            if (self.groundtruth_data[i][0] >= end_timestamp):
-                break
-        self.groundtruth_data = self.groundtruth_data[:i]
-        for i in range(len(self.groundtruth_data)):
-            if (self.groundtruth_data[i][0] >= start_timestamp):
-                break
-        self.groundtruth_data = self.groundtruth_data[i:]
+        # Groundtruth is sorted by timestamp, so the bounds are found by binary search
+        groundtruth_stamps = self.groundtruth_data[:, 0]
+        start_i = np.searchsorted(groundtruth_stamps, start_timestamp, side='left')
+        end_i = np.searchsorted(groundtruth_stamps, end_timestamp, side='left')
+        self.groundtruth_data = self.groundtruth_data[start_i:end_i]
 
         # Combine barcode Subject# with landmark Subject#
         # Lookup table to map barcode Subjec# to landmark coordinates
@@ -78,18 +92,32 @@ class ExtendedKalmanFilterSLAM():
         self.landmark_indexes = {}
         for i in range(5, len(self.barcodes_data), 1):
             self.landmark_indexes[self.barcodes_data[i][1]] = i - 4
+        # Same mapping as an array indexed by barcode, -1 for non landmark barcodes
+        # Sized to cover every barcode in the input data
+        self.landmark_lut = np.full(int(max(self.barcodes_data[:, 1].max(), self.data[:, 1].max())) + 1, -1, dtype=np.int8)
+        for barcode, index in self.landmark_indexes.items():
+            self.landmark_lut[int(barcode)] = index
 
         # Table to record if each landmark has been seen or not
         # Element [0] is not used. [1] - [15] represent for landmark# 6 - 20
         self.landmark_observed = np.full(len(self.landmark_indexes) + 1, False)
 
     def initialization(self, R, Q):
+        # State size and the state indexes of each landmark [x_l, y_l]
+        # Element [0] is not used, as in self.landmark_observed
+        self.N = 3 + 2 * len(self.landmark_indexes)
+        self.lm_x_idx = 2 * np.arange(len(self.landmark_indexes) + 1) + 1
+        self.lm_y_idx = self.lm_x_idx + 1
+
         # Initial state: 3 for robot, 2 for each landmark
-        self.states = np.zeros((1, 3 + 2 * len(self.landmark_indexes)))
-        self.states[0][:3] = self.groundtruth_data[0][1:]
+        # States and stamps are written into preallocated buffers, one row per
+        # input frame, instead of growing the history on every update
+        self._states_buf = np.zeros((len(self.data) + 1, self.N))
+        self._stamps_buf = np.empty(len(self.data) + 1)
+        self._n = 1
+        self._states_buf[0][:3] = self.groundtruth_data[0][1:]
         self.last_timestamp = self.groundtruth_data[0][0]
-        self.stamps = []
-        self.stamps.append(self.last_timestamp)
+        self._stamps_buf[0] = self.last_timestamp
 
         # EKF state covariance: (3 + 2n) x (3 + 2n)
         # For robot states, use first ground truth data as initial value
@@ -97,16 +125,28 @@ class ExtendedKalmanFilterSLAM():
         # For landmark states, we have no information at the beginning
         #   - large values for rest of variances (diagonal) data
         #   - small values for all covariances (off-diagonal) data
-        self.sigma = 1e-6 * np.full((3 + 2 * len(self.landmark_indexes), 3 + 2 * len(self.landmark_indexes)), 1)
-        for i in range(3, 3 + 2 * len(self.landmark_indexes)):
+        self.sigma = np.full((self.N, self.N), 1e-6)
+        for i in range(3, self.N):
             self.sigma[i][i] = 1e6
 
         # State covariance matrix
         self.R = R
+        # Diagonal of R, added to the robot pose variances in each motion update
+        self._R_diag3 = np.array([self.R[0][0], self.R[1][1], self.R[2][2]])
+        # Flat indexes of sigma[0][0], sigma[1][1] and sigma[2][2]
+        self._R_flat_idx = np.array([0, self.N + 1, 2 * self.N + 2])
         # Measurement covariance matrix
         self.Q = Q
 
-    def motion_update(self, control):
+        # Non-zero columns of the measurement Jacobian H = H_low x F_x:
+        # robot pose [0, 1, 2] and the associated landmark, updated in place
+        self.idx = np.array([0, 1, 2, 0, 0])
+        # Non-zero columns H_low of the measurement Jacobian, filled in place on each update
+        # Only the entries depending on the landmark change, H_low[1][2] = -1 and the last row is 0
+        self.H_low = np.zeros((3, 5))
+        self.H_low[1][2] = -1.0
+
+    def motion_update(self, timestamp, v, w):
         # ------------------ Step 1: Mean update ---------------------#
         # State: [x, y, θ, x_l1, y_l1, ......, x_ln, y_ln]
         # Control: [v, w]
@@ -116,26 +156,28 @@ class ExtendedKalmanFilterSLAM():
         #   y_t  =  y_t-1 + v * sinθ_t-1 * delta_t
         #   θ_t  =  θ_t-1 + w * delta_t
         # Skip motion update if two odometry data are too close
-        delta_t = control[0] - self.last_timestamp
+        delta_t = timestamp - self.last_timestamp
         if (delta_t < 0.001):
             return
         # Compute updated [x, y, theta]
-        x_t = self.states[-1][0] + control[2] * np.cos(self.states[-1][2]) * delta_t
-        y_t = self.states[-1][1] + control[2] * np.sin(self.states[-1][2]) * delta_t
-        theta_t = self.states[-1][2] + control[3] * delta_t
-        # Limit θ within [-pi, pi]
-        if (theta_t > np.pi):
-            theta_t -= 2 * np.pi
-        elif (theta_t < -np.pi):
-            theta_t += 2 * np.pi
-        self.last_timestamp = control[0]
+        state = self._states_buf[self._n - 1]
+        theta_prev = state[2]
+        cos_theta = math.cos(theta_prev)
+        sin_theta = math.sin(theta_prev)
+        x_t = state[0] + v * cos_theta * delta_t
+        y_t = state[1] + v * sin_theta * delta_t
+        theta_t = theta_prev + w * delta_t
+        # Limit θ within [-pi, pi)
+        theta_t = (theta_t + math.pi) % (2 * math.pi) - math.pi
+        self.last_timestamp = timestamp
         # Append new state
-        new_state = np.copy(self.states[-1])
+        new_state = self._states_buf[self._n]
+        new_state[:] = state
         new_state[0] = x_t
         new_state[1] = y_t
         new_state[2] = theta_t
-        self.states = np.append(self.states, np.array([new_state]), axis=0)
-        self.stamps.append(self.last_timestamp)
+        self._stamps_buf[self._n] = self.last_timestamp
+        self._n += 1
 
         # ------ Step 2: Linearize state-transition by Jacobian ------#
         # Jacobian of motion: G = d g(u_t, x_t-1) / d x_t-1
@@ -144,43 +186,47 @@ class ExtendedKalmanFilterSLAM():
         #         0  0             1
         #
         #                      0                    I(2n x 2n)
-        self.G = np.identity(3 + 2 * len(self.landmark_indexes))
-        self.G[0][2] = - control[2] * delta_t * np.sin(self.states[-2][2])
-        self.G[1][2] = control[2] * delta_t * np.cos(self.states[-2][2])
+        # G only differs from identity in G[0][2] and G[1][2], so it is never built
+        G_02 = - v * delta_t * sin_theta
+        G_12 = v * delta_t * cos_theta
 
         # ---------------- Step 3: Covariance update ------------------#
         # sigma = G x sigma x G.T + Fx.T x R x Fx
-        self.sigma = self.G.dot(self.sigma).dot(self.G.T)
-        self.sigma[0][0] += self.R[0][0]
-        self.sigma[1][1] += self.R[1][1]
-        self.sigma[2][2] += self.R[2][2]
-
-    def measurement_update(self, measurement):
-        # Continue if landmark is not found in self.landmark_indexes
-        if not measurement[1] in self.landmark_indexes:
+        # G x sigma only changes rows 0 and 1, (G x sigma) x G.T only columns 0 and 1
+        sigma = self.sigma
+        row_theta = sigma[2].copy()
+        sigma[0] += G_02 * row_theta
+        sigma[1] += G_12 * row_theta
+        col_theta = sigma[:, 2].copy()
+        sigma[:, 0] += G_02 * col_theta
+        sigma[:, 1] += G_12 * col_theta
+        sigma.flat[self._R_flat_idx] += self._R_diag3
+
+    def measurement_update(self, timestamp, subject, range_t, bearing_t):
+        # Continue if landmark is not found in self.landmark_lut
+        landmark_idx = int(self.landmark_lut[subject])
+        if landmark_idx < 0:
             return
 
         # Get current robot state, measurement and landmark index
-        x_t = self.states[-1][0]
-        y_t = self.states[-1][1]
-        theta_t = self.states[-1][2]
-        range_t = measurement[2]
-        bearing_t = measurement[3]
-        landmark_idx = self.landmark_indexes[measurement[1]]
+        state = self._states_buf[self._n - 1]
+        x_t = state[0]
+        y_t = state[1]
+        theta_t = state[2]
 
         # If this landmark has never been seen before: initialize landmark location in the state vector as the observed one
         #   x_l = x_t + range_t * cos(bearing_t + theta_t)
         #   y_l = y_t + range_t * sin(bearing_t + theta_t)
         if not self.landmark_observed[landmark_idx]:
-            x_l = x_t + range_t * np.cos(bearing_t + theta_t)
-            y_l = y_t + range_t * np.sin(bearing_t + theta_t)
-            self.states[-1][2 * landmark_idx + 1] = x_l
-            self.states[-1][2 * landmark_idx + 2] = y_l
+            x_l = x_t + range_t * math.cos(bearing_t + theta_t)
+            y_l = y_t + range_t * math.sin(bearing_t + theta_t)
+            state[self.lm_x_idx[landmark_idx]] = x_l
+            state[self.lm_y_idx[landmark_idx]] = y_l
             self.landmark_observed[landmark_idx] = True
         # Else use current value in state vector
         else:
-            x_l = self.states[-1][2 * landmark_idx + 1]
-            y_l = self.states[-1][2 * landmark_idx + 2]
+            x_l = state[self.lm_x_idx[landmark_idx]]
+            y_l = state[self.lm_y_idx[landmark_idx]]
 
         # ---------------- Step 1: Measurement update -----------------#
         #   range   =  sqrt((x_l - x_t)^2 + (y_l - y_t)^2)
@@ -188,8 +234,8 @@ class ExtendedKalmanFilterSLAM():
         delta_x = x_l - x_t
         delta_y = y_l - y_t
         q = delta_x ** 2 + delta_y ** 2
-        range_expected = np.sqrt(q)
-        bearing_expected = np.arctan2(delta_y, delta_x) - theta_t
+        range_expected = math.sqrt(q)
+        bearing_expected = math.atan2(delta_y, delta_x) - theta_t
 
         # ------ Step 2: Linearize Measurement Model by Jacobian ------#
         # Landmark state becomes a variable in measurement model
@@ -204,31 +250,39 @@ class ExtendedKalmanFilterSLAM():
         # H_low =   delta_y/q   -delta_x/q  -1  -delta_y/q  delta_x/q
         #               0            0       0       0          0
         # H = H_low x F_x
-        F_x = np.zeros((5, 3 + 2 * len(self.landmark_indexes)))
-        F_x[0][0] = 1.0
-        F_x[1][1] = 1.0
-        F_x[2][2] = 1.0
-        F_x[3][2 * landmark_idx + 1] = 1.0
-        F_x[4][2 * landmark_idx + 2] = 1.0
-        H_1 = np.array([-delta_x/np.sqrt(q), -delta_y/np.sqrt(q), 0, delta_x/np.sqrt(q), delta_y/np.sqrt(q)])
-        H_2 = np.array([delta_y/q, -delta_x/q, -1, -delta_y/q, delta_x/q])
-        H_3 = np.array([0, 0, 0, 0, 0])
-        self.H = np.array([H_1, H_2, H_3]).dot(F_x)
+        # F_x only selects the robot pose and this landmark, so H has 5 non-zero
+        # columns (idx) and every product with H is done on those columns only
+        inv_sqrt_q = 1.0 / range_expected
+        inv_q = 1.0 / q
+        H_low = self.H_low
+        H_low[0, 0] = -delta_x * inv_sqrt_q
+        H_low[0, 1] = -delta_y * inv_sqrt_q
+        H_low[0, 3] = delta_x * inv_sqrt_q
+        H_low[0, 4] = delta_y * inv_sqrt_q
+        H_low[1, 0] = delta_y * inv_q
+        H_low[1, 1] = -delta_x * inv_q
+        H_low[1, 3] = -delta_y * inv_q
+        H_low[1, 4] = delta_x * inv_q
+        self.idx[3] = self.lm_x_idx[landmark_idx]
+        self.idx[4] = self.lm_y_idx[landmark_idx]
 
         # ---------------- Step 3: Kalman gain update -----------------#
-        S_t = self.H.dot(self.sigma).dot(self.H.T) + self.Q
-        self.K = self.sigma.dot(self.H.T).dot(np.linalg.inv(S_t))
+        # sigma x H.T = sigma[:, idx] x H_low.T
+        sigma_H = self.sigma[:, self.idx].dot(self.H_low.T)
+        S_t = self.H_low.dot(sigma_H[self.idx]) + self.Q
+        self.K = sigma_H.dot(inv3(S_t))
 
         # ------------------- Step 4: mean update ---------------------#
         difference = np.array([range_t - range_expected, bearing_t - bearing_expected, 0])
         innovation = self.K.dot(difference)
-        new_state = self.states[-1] + innovation
-        self.states = np.append(self.states, np.array([new_state]), axis=0)
-        self.last_timestamp = measurement[0]
-        self.stamps.append(self.last_timestamp)
+        np.add(self._states_buf[self._n - 1], innovation, out=self._states_buf[self._n])
+        self.last_timestamp = timestamp
+        self._stamps_buf[self._n] = self.last_timestamp
+        self._n += 1
 
         # ---------------- Step 5: covariance update ------------------#
-        self.sigma = (np.identity(3 + 2 * len(self.landmark_indexes)) - self.K.dot(self.H)).dot(self.sigma)
+        # sigma = (I - K x H) x sigma = sigma - K x H_low x sigma[idx], written in place
+        np.subtract(self.sigma, self.K.dot(self.H_low.dot(self.sigma[self.idx])), out=self.sigma)
 
     def plot_data(self):
         # Clear all
@@ -272,20 +326,35 @@ class ExtendedKalmanFilterSLAM():
 
     def build_dataframes(self):
         self.gt = build_timeseries(self.groundtruth_data, cols=['stamp','x','y','theta'])
-        data = np.array(self.states[:,:3])
-        stamp = np.expand_dims(self.stamps, axis=1)
-        data_s = np.hstack([stamp,data])
-        self.robot_states = build_timeseries(data_s, cols=['stamp','x','y','theta'])
+        self.robot_states = build_state_timeseries(self.stamps, self.states[:,:3], cols=['x','y','theta'])
         
+def inv3(M):
+    # Closed-form inverse of a 3 x 3 matrix by cofactors
+    a, b, c, d, e, f, g, h, i = M.flat
+    A = e * i - f * h
+    B = -(d * i - f * g)
+    C = d * h - e * g
+    D = -(b * i - c * h)
+    E = a * i - c * g
+    F = -(a * h - b * g)
+    G = b * f - c * e
+    H = -(a * f - c * d)
+    I = a * e - b * d
+    det = a * A + b * B + c * C
+    return np.array([[A, D, G], [B, E, H], [C, F, I]]) / det
+
 def build_timeseries(data,cols):
-    timeseries = pd.DataFrame(data, columns=cols)
-    timeseries['stamp'] = pd.to_datetime(timeseries['stamp'], unit='s')
+    # Build columns from 1-D arrays, stamps are converted to datetime only here
+    data = np.asarray(data)
+    timeseries = pd.DataFrame({col: data[:, i] for i, col in enumerate(cols)})
+    timeseries['stamp'] = pd.to_datetime(timeseries['stamp'], unit='s', cache=True)
     timeseries = timeseries.set_index('stamp')
     return timeseries
 
 def build_state_timeseries(stamp,data,cols):
-    timeseries = pd.DataFrame(data, columns=cols)
-    timeseries['stamp'] = pd.to_datetime(stamp, unit='s')
+    data = np.asarray(data)
+    timeseries = pd.DataFrame({col: data[:, i] for i, col in enumerate(cols)})
+    timeseries['stamp'] = pd.to_datetime(stamp, unit='s', cache=True)
     timeseries = timeseries.set_index('stamp')
     return timeseries
 
@@ -7,27 +7,44 @@ See Probabilistic Robotics:
 
 '''
 
+import math
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from numba import njit, prange
 
 
 class ExtendedKalmanFilterSLAM():
-    def __init__(self, dataset, robot, start_frame, end_frame, R, Q, plot, plot_inter):
+    def __init__(self, dataset, robot, start_frame, end_frame, R, Q, plot, plot_inter, jit=True, parallel=False):
+        # jit: use the numba compiled data association, otherwise the NumPy vectorized one
+        # parallel: evaluate landmarks in parallel threads in the numba data association,
+        #   only worth it for maps with many landmarks
+        self.jit = jit
+        self.parallel = parallel
         self.load_data(dataset, robot, start_frame, end_frame)
         self.initialization(R, Q)
-        for data in self.data:
-            if (data[1] == -1):
-                self.motion_update(data)
+        for k in range(len(self._ts)):
+            if (self._subj[k] == -1):
+                self.motion_update(self._ts[k], self._v[k], self._w[k])
             else:
-                self.data_association(data)
-                self.measurement_update(data)
+                self.data_association(self._subj[k], self._v[k], self._w[k])
+                self.measurement_update(self._ts[k], self._subj[k])
             # Plot every n frames
             if plot and plot_inter:
                 if (len(self.states) > (800 - start_frame) and len(self.states) % 30 == 0):
                     self.plot_data()
         if plot: self.plot_data()
 
+    @property
+    def states(self):
+        # Filled part of the state history buffer
+        return self._states_buf[:self._n]
+
+    @property
+    def stamps(self):
+        # Filled part of the timestamp history buffer
+        return self._stamps_buf[:self._n]
+
     def load_data(self, dataset, robot, start_frame, end_frame):
         # Loading dataset
         # Barcodes: [Subject#, Barcode#]
@@ -54,17 +71,20 @@ class ExtendedKalmanFilterSLAM():
             start_frame += 1
         # Remove all data before start_frame and after the end_timestamp
         self.data = self.data[start_frame:end_frame]
+        # Column views of the input data, the main loop reads them by index
+        # [Time[s], Subject#, forward_V[m/s] or range[m], angular _v[rad/s] or bearing[rad]]
+        self._ts = self.data[:, 0]
+        self._subj = self.data[:, 1].astype(np.int32)
+        self._v = self.data[:, 2]
+        self._w = self.data[:, 3]
         start_timestamp = self.data[0][0]
         end_timestamp = self.data[-1][0]
         # Remove all groundtruth outside the range
-        for i in range(len(self.groundtruth_data)):
-            if (self.groundtruth_data[i][0] >= end_timestamp):
-                break
-        self.groundtruth_data = self.groundtruth_data[:i]
-        for i in range(len(self.groundtruth_data)):
-            if (self.groundtruth_data[i][0] >= start_timestamp):
-                break
-        self.groundtruth_data = self.groundtruth_data[i:]
+        # Groundtruth is sorted by timestamp, so the bounds are found by binary search
+        groundtruth_stamps = self.groundtruth_data[:, 0]
+        start_i = np.searchsorted(groundtruth_stamps, start_timestamp, side='left')
+        end_i = np.searchsorted(groundtruth_stamps, end_timestamp, side='left')
+        self.groundtruth_data = self.groundtruth_data[start_i:end_i]
 
         # Combine barcode Subject# with landmark Subject#
         # Lookup table to map barcode Subjec# to landmark coordinates
@@ -80,19 +100,33 @@ class ExtendedKalmanFilterSLAM():
         self.landmark_indexes = {}
         for i in range(5, len(self.barcodes_data), 1):
             self.landmark_indexes[self.barcodes_data[i][1]] = i - 4
+        # Same mapping as an array indexed by barcode, -1 for non landmark barcodes
+        # Sized to cover every barcode in the input data
+        self.landmark_lut = np.full(int(max(self.barcodes_data[:, 1].max(), self.data[:, 1].max())) + 1, -1, dtype=np.int8)
+        for barcode, index in self.landmark_indexes.items():
+            self.landmark_lut[int(barcode)] = index
 
         # Table to record if each landmark has been seen or not
         # Element [0] is not used. [1] - [15] represent for landmark# 6 - 20
         self.landmark_observed = np.full(len(self.landmark_indexes) + 1, False)
 
     def initialization(self, R, Q):
+        # State size and the state indexes of each landmark [x_l, y_l]
+        # Element [0] is not used, as in self.landmark_observed
+        self.N = 3 + 2 * len(self.landmark_indexes)
+        self.lm_x_idx = 2 * np.arange(len(self.landmark_indexes) + 1) + 1
+        self.lm_y_idx = self.lm_x_idx + 1
+
         # Initial state: 3 for robot, 2 for each landmark
         # To simplify, use fixed number of landmarks for states and covariances
-        self.states = np.zeros((1, 3 + 2 * len(self.landmark_indexes)))
-        self.states[0][:3] = self.groundtruth_data[0][1:]
+        # States and stamps are written into preallocated buffers, one row per
+        # input frame, instead of growing the history on every update
+        self._states_buf = np.zeros((len(self.data) + 1, self.N))
+        self._stamps_buf = np.empty(len(self.data) + 1)
+        self._n = 1
+        self._states_buf[0][:3] = self.groundtruth_data[0][1:]
         self.last_timestamp = self.groundtruth_data[0][0]
-        self.stamps = []
-        self.stamps.append(self.last_timestamp)
+        self._stamps_buf[0] = self.last_timestamp
 
         # EKF state covariance: (3 + 2n) x (3 + 2n)
         # For robot states, use first ground truth data as initial value
@@ -100,16 +134,24 @@ class ExtendedKalmanFilterSLAM():
         # For landmark states, we have no information at the beginning
         #   - large values for rest of variances (diagonal) data
         #   - small values for all covariances (off-diagonal) data
-        self.sigma = 1e-6 * np.full((3 + 2 * len(self.landmark_indexes), 3 + 2 * len(self.landmark_indexes)), 1)
-        for i in range(3, 3 + 2 * len(self.landmark_indexes)):
+        self.sigma = np.full((self.N, self.N), 1e-6)
+        for i in range(3, self.N):
             self.sigma[i][i] = 1e6
 
         # State covariance matrix
         self.R = R
+        # Diagonal of R, added to the robot pose variances in each motion update
+        self._R_diag3 = np.array([self.R[0][0], self.R[1][1], self.R[2][2]])
+        # Flat indexes of sigma[0][0], sigma[1][1] and sigma[2][2]
+        self._R_flat_idx = np.array([0, self.N + 1, 2 * self.N + 2])
         # Measurement covariance matrix
         self.Q = Q
 
-    def motion_update(self, control):
+        # Non-zero columns of the measurement Jacobian H = H_low x F_x:
+        # robot pose [0, 1, 2] and the associated landmark, updated in place
+        self.idx = np.array([0, 1, 2, 0, 0])
+
+    def motion_update(self, timestamp, v, w):
         # ------------------ Step 1: Mean update ---------------------#
         # State: [x, y, θ, x_l1, y_l1, ......, x_ln, y_ln]
         # Control: [v, w]
@@ -119,26 +161,28 @@ class ExtendedKalmanFilterSLAM():
         #   y_t  =  y_t-1 + v * sinθ_t-1 * delta_t
         #   θ_t  =  θ_t-1 + w * delta_t
         # Skip motion update if two odometry data are too close
-        delta_t = control[0] - self.last_timestamp
+        delta_t = timestamp - self.last_timestamp
         if (delta_t < 0.001):
             return
         # Compute updated [x, y, theta]
-        x_t = self.states[-1][0] + control[2] * np.cos(self.states[-1][2]) * delta_t
-        y_t = self.states[-1][1] + control[2] * np.sin(self.states[-1][2]) * delta_t
-        theta_t = self.states[-1][2] + control[3] * delta_t
-        # Limit θ within [-pi, pi]
-        if (theta_t > np.pi):
-            theta_t -= 2 * np.pi
-        elif (theta_t < -np.pi):
-            theta_t += 2 * np.pi
-        self.last_timestamp = control[0]
+        state = self._states_buf[self._n - 1]
+        theta_prev = state[2]
+        cos_theta = math.cos(theta_prev)
+        sin_theta = math.sin(theta_prev)
+        x_t = state[0] + v * cos_theta * delta_t
+        y_t = state[1] + v * sin_theta * delta_t
+        theta_t = theta_prev + w * delta_t
+        # Limit θ within [-pi, pi)
+        theta_t = (theta_t + math.pi) % (2 * math.pi) - math.pi
+        self.last_timestamp = timestamp
         # Append new state
-        new_state = np.copy(self.states[-1])
+        new_state = self._states_buf[self._n]
+        new_state[:] = state
         new_state[0] = x_t
         new_state[1] = y_t
         new_state[2] = theta_t
-        self.states = np.append(self.states, np.array([new_state]), axis=0)
-        self.stamps.append(self.last_timestamp)
+        self._stamps_buf[self._n] = self.last_timestamp
+        self._n += 1
 
         # ------ Step 2: Linearize state-transition by Jacobian ------#
         # Jacobian of motion: G = d g(u_t, x_t-1) / d x_t-1
@@ -147,118 +191,77 @@ class ExtendedKalmanFilterSLAM():
         #         0  0             1
         #
         #                      0                    I(2n x 2n)
-        self.G = np.identity(3 + 2 * len(self.landmark_indexes))
-        self.G[0][2] = - control[2] * delta_t * np.sin(self.states[-2][2])
-        self.G[1][2] = control[2] * delta_t * np.cos(self.states[-2][2])
+        # G only differs from identity in G[0][2] and G[1][2], so it is never built
+        G_02 = - v * delta_t * sin_theta
+        G_12 = v * delta_t * cos_theta
 
         # ---------------- Step 3: Covariance update ------------------#
         # sigma = G x sigma x G.T + Fx.T x R x Fx
-        self.sigma = self.G.dot(self.sigma).dot(self.G.T)
-        self.sigma[0][0] += self.R[0][0]
-        self.sigma[1][1] += self.R[1][1]
-        self.sigma[2][2] += self.R[2][2]
-
-    def data_association(self, measurement):
+        # G x sigma only changes rows 0 and 1, (G x sigma) x G.T only columns 0 and 1
+        sigma = self.sigma
+        row_theta = sigma[2].copy()
+        sigma[0] += G_02 * row_theta
+        sigma[1] += G_12 * row_theta
+        col_theta = sigma[:, 2].copy()
+        sigma[:, 0] += G_02 * col_theta
+        sigma[:, 1] += G_12 * col_theta
+        sigma.flat[self._R_flat_idx] += self._R_diag3
+
+    def data_association(self, subject, range_t, bearing_t):
         # Return if this measurement is not from a a landmark (other robots)
-        if not measurement[1] in self.landmark_indexes:
+        landmark_idx = int(self.landmark_lut[subject])
+        if landmark_idx < 0:
             return
 
         # Get current robot state, measurement
-        x_t = self.states[-1][0]
-        y_t = self.states[-1][1]
-        theta_t = self.states[-1][2]
-        range_t = measurement[2]
-        bearing_t = measurement[3]
+        state = self._states_buf[self._n - 1]
+        x_t = state[0]
+        y_t = state[1]
+        theta_t = state[2]
 
         # The expected landmark's location based on current robot state and measurement
         #   x_l = x_t + range_t * cos(bearing_t + theta_t)
         #   y_l = y_t + range_t * sin(bearing_t + theta_t)
-        landmark_x_expected = x_t + range_t * np.cos(bearing_t + theta_t)
-        landmark_y_expected = y_t + range_t * np.sin(bearing_t + theta_t)
+        landmark_x_expected = x_t + range_t * math.cos(bearing_t + theta_t)
+        landmark_y_expected = y_t + range_t * math.sin(bearing_t + theta_t)
 
-        # If the current landmark has not been seen, initilize its location as the expected one
-        landmark_idx = self.landmark_indexes[measurement[1]]
+        # If the current landmark has not been seen, its location is initialized as the expected one
+        # Then calculate the Likelihood for each existed landmark and keep the one with least distance
         self.landmark_idx = landmark_idx
-        if not self.landmark_observed[landmark_idx]:
-            self.landmark_observed[landmark_idx] = True
-            self.states[-1][2 * landmark_idx + 1] = landmark_x_expected
-            self.states[-1][2 * landmark_idx + 2] = landmark_y_expected
-
-        # Calculate the Likelihood for each existed landmark
-        min_distance = 1e16
-        for i in range(1, len(self.landmark_indexes) + 1):
-            # Continue if this landmark has not been observed
-            if not self.landmark_observed[i]:
-                continue
-
-            # Get current landmark estimate
-            x_l = self.states[-1][2 * i + 1]
-            y_l = self.states[-1][2 * i + 2]
-
-            # Calculate expected range and bearing measurement
-            #   range   =  sqrt((x_l - x_t)^2 + (y_l - y_t)^2)
-            #  bearing  =  atan2((y_l - y_t) / (x_l - x_t)) - θ_t
-            delta_x = x_l - x_t
-            delta_y = y_l - y_t
-            q = delta_x ** 2 + delta_y ** 2
-            range_expected = np.sqrt(q)
-            bearing_expected = np.arctan2(delta_y, delta_x) - theta_t
-
-            # Compute Jacobian H of Measurement Model
-            # Landmark state becomes a variable in measurement model
-            # Jacobian: H = d h(x_t, x_l) / d (x_t, x_l)
-            #        1 0 0  0 ...... 0   0 0   0 ...... 0
-            #        0 1 0  0 ...... 0   0 0   0 ...... 0
-            # F_x =  0 0 1  0 ...... 0   0 0   0 ...... 0
-            #        0 0 0  0 ...... 0   1 0   0 ...... 0
-            #        0 0 0  0 ...... 0   0 1   0 ...... 0
-            #          (2*landmark_idx - 2)
-            #          -delta_x/√q  -delta_y/√q  0  delta_x/√q  delta_y/√q
-            # H_low =   delta_y/q   -delta_x/q  -1  -delta_y/q  delta_x/q
-            #               0            0       0       0          0
-            # H = H_low x F_x
-            F_x = np.zeros((5, 3 + 2 * len(self.landmark_indexes)))
-            F_x[0][0] = 1.0
-            F_x[1][1] = 1.0
-            F_x[2][2] = 1.0
-            F_x[3][2 * i + 1] = 1.0
-            F_x[4][2 * i + 2] = 1.0
-            H_1 = np.array([-delta_x/np.sqrt(q), -delta_y/np.sqrt(q), 0, delta_x/np.sqrt(q), delta_y/np.sqrt(q)])
-            H_2 = np.array([delta_y/q, -delta_x/q, -1, -delta_y/q, delta_x/q])
-            H_3 = np.array([0, 0, 0, 0, 0])
-            H = np.array([H_1, H_2, H_3]).dot(F_x)
-
-            # Compute Mahalanobis distance
-            Psi = H.dot(self.sigma).dot(H.T) + self.Q
-            difference = np.array([range_t - range_expected, bearing_t - bearing_expected, 0])
-            Pi = difference.T.dot(np.linalg.inv(Psi)).dot(difference)
-
-            # Get landmark information with least distance
-            if Pi < min_distance:
-                min_distance = Pi
-                # Values for measurement update
-                self.H = H
-                self.Psi = Psi
-                self.difference = difference
-                # Values for plotting data association
-                self.landmark_expected = np.array([landmark_x_expected, landmark_y_expected])
-                self.landmark_current = np.array([x_l, y_l])
-
-    def measurement_update(self, measurement):
+        if not self.jit:
+            associate = _associate_vectorized
+        elif self.parallel:
+            associate = _associate_parallel
+        else:
+            associate = _associate
+        i, self.H_low, self.Psi, self.difference = associate(
+            self.sigma, state, self.landmark_observed, landmark_idx, landmark_x_expected, landmark_y_expected,
+            x_t, y_t, theta_t, range_t, bearing_t, self.Q)
+        # Values for measurement update
+        # H is kept as its 5 non-zero columns: H = H_low x F_x = H_low in columns idx
+        self.idx[3] = self.lm_x_idx[i]
+        self.idx[4] = self.lm_y_idx[i]
+        # Values for plotting data association
+        self.landmark_expected = np.array([landmark_x_expected, landmark_y_expected])
+        self.landmark_current = np.array([state[self.lm_x_idx[i]], state[self.lm_y_idx[i]]])
+
+    def measurement_update(self, timestamp, subject):
         # Return if this measurement is not from a a landmark (other robots)
-        if not measurement[1] in self.landmark_indexes:
+        if self.landmark_lut[subject] < 0:
             return
 
         # Update mean
-        self.K = self.sigma.dot(self.H.T).dot(np.linalg.inv(self.Psi))
+        # sigma x H.T = sigma[:, idx] x H_low.T
+        self.K = self.sigma[:, self.idx].dot(self.H_low.T).dot(inv3(self.Psi))
         innovation = self.K.dot(self.difference)
-        new_state = self.states[-1] + innovation
-        self.states = np.append(self.states, np.array([new_state]), axis=0)
-        self.last_timestamp = measurement[0]
-        self.stamps.append(self.last_timestamp)
+        np.add(self._states_buf[self._n - 1], innovation, out=self._states_buf[self._n])
+        self.last_timestamp = timestamp
+        self._stamps_buf[self._n] = self.last_timestamp
+        self._n += 1
 
         # Update covariance
-        self.sigma = (np.identity(3 + 2 * len(self.landmark_indexes)) - self.K.dot(self.H)).dot(self.sigma)
+        # sigma = (I - K x H) x sigma = sigma - K x H_low x sigma[idx], written in place
+        np.subtract(self.sigma, self.K.dot(self.H_low.dot(self.sigma[self.idx])), out=self.sigma)
 
     def plot_data(self):
         # Clear all
@@ -311,20 +314,223 @@ class ExtendedKalmanFilterSLAM():
 
     def build_dataframes(self):
         self.gt = build_timeseries(self.groundtruth_data, cols=['stamp','x','y','theta'])
-        data = np.array(self.states[:,:3])
-        stamp = np.expand_dims(self.stamps, axis=1)
-        data_s = np.hstack([stamp,data])
-        self.robot_states = build_timeseries(data_s, cols=['stamp','x','y','theta'])
+        self.robot_states = build_state_timeseries(self.stamps, self.states[:,:3], cols=['x','y','theta'])
         
+def inv3(M):
+    # Closed-form inverse of a 3 x 3 matrix by cofactors
+    a, b, c, d, e, f, g, h, i = M.flat
+    A = e * i - f * h
+    B = -(d * i - f * g)
+    C = d * h - e * g
+    D = -(b * i - c * h)
+    E = a * i - c * g
+    F = -(a * h - b * g)
+    G = b * f - c * e
+    H = -(a * f - c * d)
+    I = a * e - b * d
+    det = a * A + b * B + c * C
+    return np.array([[A, D, G], [B, E, H], [C, F, I]]) / det
+
+@njit(cache=True)
+def _likelihood(sigma, state, i, x_t, y_t, theta_t, range_t, bearing_t, Q, H_low, Psi, difference):
+    # Mahalanobis distance between landmark i and the current measurement
+    # H_low, Psi and difference of this landmark are written in place
+    # Get current landmark estimate
+    x_l = state[2 * i + 1]
+    y_l = state[2 * i + 2]
+
+    # Calculate expected range and bearing measurement
+    #   range   =  sqrt((x_l - x_t)^2 + (y_l - y_t)^2)
+    #  bearing  =  atan2((y_l - y_t) / (x_l - x_t)) - θ_t
+    delta_x = x_l - x_t
+    delta_y = y_l - y_t
+    q = delta_x ** 2 + delta_y ** 2
+    range_expected = math.sqrt(q)
+    bearing_expected = math.atan2(delta_y, delta_x) - theta_t
+
+    # Compute Jacobian H of Measurement Model
+    # Landmark state becomes a variable in measurement model
+    # Jacobian: H = d h(x_t, x_l) / d (x_t, x_l)
+    #        1 0 0  0 ...... 0   0 0   0 ...... 0
+    #        0 1 0  0 ...... 0   0 0   0 ...... 0
+    # F_x =  0 0 1  0 ...... 0   0 0   0 ...... 0
+    #        0 0 0  0 ...... 0   1 0   0 ...... 0
+    #        0 0 0  0 ...... 0   0 1   0 ...... 0
+    #          (2*landmark_idx - 2)
+    #          -delta_x/√q  -delta_y/√q  0  delta_x/√q  delta_y/√q
+    # H_low =   delta_y/q   -delta_x/q  -1  -delta_y/q  delta_x/q
+    #               0            0       0       0          0
+    # H = H_low x F_x, F_x only selects the columns idx of sigma
+    inv_sqrt_q = 1.0 / range_expected
+    inv_q = 1.0 / q
+    H_low[0, 0] = -delta_x * inv_sqrt_q
+    H_low[0, 1] = -delta_y * inv_sqrt_q
+    H_low[0, 2] = 0.0
+    H_low[0, 3] = delta_x * inv_sqrt_q
+    H_low[0, 4] = delta_y * inv_sqrt_q
+    H_low[1, 0] = delta_y * inv_q
+    H_low[1, 1] = -delta_x * inv_q
+    H_low[1, 2] = -1.0
+    H_low[1, 3] = -delta_y * inv_q
+    H_low[1, 4] = delta_x * inv_q
+    H_low[2, :] = 0.0
+
+    # Compute Mahalanobis distance
+    # Psi = H x sigma x H.T + Q = H_low x sigma[idx, idx] x H_low.T + Q
+    # with idx = [0, 1, 2, 2 * i + 1, 2 * i + 2], i.e. column a maps to a for the
+    # robot pose and to 2 * i + a - 2 for the landmark
+    for r in range(3):
+        for c in range(3):
+            total = Q[r, c]
+            for a in range(5):
+                row = a if a < 3 else 2 * i + a - 2
+                for b in range(5):
+                    col = b if b < 3 else 2 * i + b - 2
+                    total += H_low[r, a] * sigma[row, col] * H_low[c, b]
+            Psi[r, c] = total
+    # Pi = difference.T x inv(Psi) x difference, with difference[2] = 0 only the
+    # top-left 2 x 2 cofactors of Psi are needed
+    difference[0] = range_t - range_expected
+    difference[1] = bearing_t - bearing_expected
+    difference[2] = 0.0
+    cof_A = Psi[1, 1] * Psi[2, 2] - Psi[1, 2] * Psi[2, 1]
+    cof_B = -(Psi[1, 0] * Psi[2, 2] - Psi[1, 2] * Psi[2, 0])
+    cof_C = Psi[1, 0] * Psi[2, 1] - Psi[1, 1] * Psi[2, 0]
+    cof_D = -(Psi[0, 1] * Psi[2, 2] - Psi[0, 2] * Psi[2, 1])
+    cof_E = Psi[0, 0] * Psi[2, 2] - Psi[0, 2] * Psi[2, 0]
+    det = Psi[0, 0] * cof_A + Psi[0, 1] * cof_B + Psi[0, 2] * cof_C
+    d_0 = difference[0]
+    d_1 = difference[1]
+    return (d_0 * (cof_A * d_0 + cof_D * d_1) + d_1 * (cof_B * d_0 + cof_E * d_1)) / det
+
+@njit(cache=True)
+def _associate(sigma, state, landmark_observed, landmark_idx, landmark_x_expected, landmark_y_expected,
+               x_t, y_t, theta_t, range_t, bearing_t, Q):
+    # Maximum likelihood data association compiled with numba
+    # Returns the index, H_low, Psi and measurement difference of the observed
+    # landmark with least Mahalanobis distance to the current measurement
+    # If the current landmark has not been seen, initialize its location as the expected one
+    if not landmark_observed[landmark_idx]:
+        state[2 * landmark_idx + 1] = landmark_x_expected
+        state[2 * landmark_idx + 2] = landmark_y_expected
+        landmark_observed[landmark_idx] = True
+
+    min_distance = 1e16
+    best_i = 0
+    best_H_low = np.zeros((3, 5))
+    best_Psi = np.zeros((3, 3))
+    best_difference = np.zeros(3)
+    H_low = np.zeros((3, 5))
+    Psi = np.zeros((3, 3))
+    difference = np.zeros(3)
+    for i in range(1, len(landmark_observed)):
+        # Continue if this landmark has not been observed
+        if not landmark_observed[i]:
+            continue
+
+        Pi = _likelihood(sigma, state, i, x_t, y_t, theta_t, range_t, bearing_t, Q, H_low, Psi, difference)
+
+        # Get landmark information with least distance
+        if Pi < min_distance:
+            min_distance = Pi
+            best_i = i
+            best_H_low[:] = H_low
+            best_Psi[:] = Psi
+            best_difference[:] = difference
+    return best_i, best_H_low, best_Psi, best_difference
+
+@njit(parallel=True, cache=True)
+def _associate_parallel(sigma, state, landmark_observed, landmark_idx, landmark_x_expected, landmark_y_expected,
+                        x_t, y_t, theta_t, range_t, bearing_t, Q):
+    # Same as _associate with the landmarks evaluated in parallel threads
+    # Every landmark writes its own row of H_low, Psi and difference, and the
+    # least distance is searched afterwards outside the parallel loop
+    # If the current landmark has not been seen, initialize its location as the expected one
+    if not landmark_observed[landmark_idx]:
+        state[2 * landmark_idx + 1] = landmark_x_expected
+        state[2 * landmark_idx + 2] = landmark_y_expected
+        landmark_observed[landmark_idx] = True
+
+    n = len(landmark_observed)
+    Pi = np.full(n, 1e16)
+    H_low = np.zeros((n, 3, 5))
+    Psi = np.zeros((n, 3, 3))
+    difference = np.zeros((n, 3))
+    for i in prange(1, n):
+        if landmark_observed[i]:
+            Pi[i] = _likelihood(sigma, state, i, x_t, y_t, theta_t, range_t, bearing_t, Q, H_low[i], Psi[i], difference[i])
+
+    # Get landmark information with least distance
+    min_distance = 1e16
+    best_i = 0
+    for i in range(1, n):
+        if Pi[i] < min_distance:
+            min_distance = Pi[i]
+            best_i = i
+    return best_i, H_low[best_i].copy(), Psi[best_i].copy(), difference[best_i].copy()
+
+def _associate_vectorized(sigma, state, landmark_observed, landmark_idx, landmark_x_expected, landmark_y_expected,
+                          x_t, y_t, theta_t, range_t, bearing_t, Q):
+    # Same as _associate, vectorized with NumPy over all observed landmarks at once
+    # If the current landmark has not been seen, initialize its location as the expected one
+    landmark = slice(2 * landmark_idx + 1, 2 * landmark_idx + 3)
+    state[landmark] = np.where(landmark_observed[landmark_idx], state[landmark], (landmark_x_expected, landmark_y_expected))
+    landmark_observed[landmark_idx] = True
+
+    i = np.flatnonzero(landmark_observed)
+    x_l = state[2 * i + 1]
+    y_l = state[2 * i + 2]
+
+    # Expected range and bearing measurement for every landmark
+    delta_x = x_l - x_t
+    delta_y = y_l - y_t
+    q = delta_x ** 2 + delta_y ** 2
+    sqrt_q = np.sqrt(q)
+    range_expected = sqrt_q
+    bearing_expected = np.arctan2(delta_y, delta_x) - theta_t
+
+    # Stack of H_low (k x 3 x 5) and their non-zero columns idx (k x 5)
+    H_low = np.zeros((len(i), 3, 5))
+    H_low[:, 0, 0] = -delta_x / sqrt_q
+    H_low[:, 0, 1] = -delta_y / sqrt_q
+    H_low[:, 0, 3] = delta_x / sqrt_q
+    H_low[:, 0, 4] = delta_y / sqrt_q
+    H_low[:, 1, 0] = delta_y / q
+    H_low[:, 1, 1] = -delta_x / q
+    H_low[:, 1, 2] = -1.0
+    H_low[:, 1, 3] = -delta_y / q
+    H_low[:, 1, 4] = delta_x / q
+    idx = np.empty((len(i), 5), dtype=np.int64)
+    idx[:, :3] = [0, 1, 2]
+    idx[:, 3] = 2 * i + 1
+    idx[:, 4] = 2 * i + 2
+    sigma_sub = sigma[idx[:, :, None], idx[:, None, :]]
+
+    # Mahalanobis distances
+    Psi = np.einsum('kij,kjl,kml->kim', H_low, sigma_sub, H_low) + Q
+    difference = np.zeros((len(i), 3))
+    difference[:, 0] = range_t - range_expected
+    difference[:, 1] = bearing_t - bearing_expected
+    # Pi = difference.T x inv(Psi) x difference, solved for all landmarks in one batched call
+    solution = np.linalg.solve(Psi, difference[:, :, None])[:, :, 0]
+    Pi = np.einsum('ki,ki->k', difference, solution)
+
+    # Landmark with least distance
+    best = np.argmin(Pi)
+    return i[best], H_low[best], Psi[best], difference[best]
+
 def build_timeseries(data,cols):
-    timeseries = pd.DataFrame(data, columns=cols)
-    timeseries['stamp'] = pd.to_datetime(timeseries['stamp'], unit='s')
+    # Build columns from 1-D arrays, stamps are converted to datetime only here
+    data = np.asarray(data)
+    timeseries = pd.DataFrame({col: data[:, i] for i, col in enumerate(cols)})
+    timeseries['stamp'] = pd.to_datetime(timeseries['stamp'], unit='s', cache=True)
     timeseries = timeseries.set_index('stamp')
     return timeseries
 
 def build_state_timeseries(stamp,data,cols):
-    timeseries = pd.DataFrame(data, columns=cols)
-    timeseries['stamp'] = pd.to_datetime(stamp, unit='s')
+    data = np.asarray(data)
+    timeseries = pd.DataFrame({col: data[:, i] for i, col in enumerate(cols)})
+    timeseries['stamp'] = pd.to_datetime(stamp, unit='s', cache=True)
     timeseries = timeseries.set_index('stamp')
     return timeseries
 